@@ -1,8 +1,14 @@
+import hashlib
 import logging
-from random import randint
+import math
+from collections import deque
 from time import time
 from typing import cast
 import os
+import pickle
+import tempfile
+
+import numpy as np
 
 from geniusweb.actions.Accept import Accept
 from geniusweb.actions.Action import Action
@@ -29,6 +35,26 @@ from geniusweb.references.Parameters import Parameters
 from tudelft_utilities_logging.ReportToLogger import ReportToLogger
 
 from .utils.opponent_model import OpponentModel
+from .utils.score_kernel import score, time_pressure, upper_bound
+
+# bump when the way the utility table is computed changes, stored tables of other versions are not loaded
+UTILITY_TABLE_VERSION = 2
+
+# domains with at most this many bids are searched completely, in larger ones bids are sampled
+FULL_SCAN_MAX_BIDS = 50000
+
+# an opponent model carried over from earlier sessions counts as at most this many received bids,
+# so the offers of the current session soon outweigh it
+CARRIED_OVER_BIDS = 50
+
+# offers we accept once we have an opponent model, as windows of
+# (progress from, progress to, our utility above, opponent utility from, opponent utility to), all bounds exclusive
+ACCEPT_RULES = (
+    (-math.inf, 0.6, 0.75, -math.inf, 0.7),  # opponent is conceding early and we got something decent
+    (0.97, math.inf, 0.85, 0.6, math.inf),  # near the end and both sides are being fair
+)
+# against nice opponents we also accept if both sides get 0.75+, it's fair
+NICE_ACCEPT_RULES = ACCEPT_RULES + ((0.75, math.inf, 0.75, 0.7, math.inf),)
 
 
 class BoboAgent(DefaultParty):
@@ -48,12 +74,31 @@ class BoboAgent(DefaultParty):
         self.other: str = None
         self.settings: Settings = None
         self.storage_dir: str = None
-        self.opponent_utils = []  # Store all predicted utilities of opponent's offers
+        self.opponent_utils = deque(maxlen=5)  # Store the predicted utilities of the opponent's 5 most recent offers
+        self.opponent_utils_sum = 0.0  # Running sum of opponent_utils
         self.opponent_is_greedy = False  # Flag is the robot is a bully (utility always over 0.9)
         self.opponent_is_nice = False  # Flag for nice robots
 
         self.last_received_bid: Bid = None
         self.opponent_model: OpponentModel = None
+
+        # all possible bids in the domain (its finite) and how many there are
+        self._all_bids: AllBidsList = None
+        self._all_bids_size: int = 0
+        # our utility of every bid, indexed like AllBidsList. In domains too large to search completely
+        # only the bids we sampled are filled in
+        self._our_utils: np.ndarray = None
+        self._our_utils_filled: np.ndarray = None
+        # the value of every issue in every bid, numbered like the opponent model does,
+        # only filled in for bids we scored, so large domains are never walked completely
+        self._bid_values: np.ndarray = None
+        self._bid_values_filled: np.ndarray = None
+        # indices of all bids, from the best to the worst for us, only for domains we search completely
+        self._ranked_bids: np.ndarray = None
+        # random generator used to sample bids
+        self._rng = np.random.default_rng()
+        # our utility of bids we got offered, our profile doesn't change during the session
+        self._our_util_cache = {}
         self.logger.log(logging.INFO, "party is initialized")
 
     def notifyChange(self, data: Inform):
@@ -89,7 +134,8 @@ class BoboAgent(DefaultParty):
             )
             self.profile = profile_connection.getProfile()
             self.domain = self.profile.getDomain()
-            self.load_opponent_data()
+            self._all_bids = AllBidsList(self.domain)
+            self._all_bids_size = self._all_bids.size()
             profile_connection.close()
 
         # ActionDone informs you of an action (an offer or an accept)
@@ -101,8 +147,11 @@ class BoboAgent(DefaultParty):
 
             # ignore action if it is our action
             if actor != self.me:
-                # obtain the name of the opponent, cutting of the position ID.
-                self.other = str(actor).rsplit("_", 1)[0]
+                # obtain the name of the opponent, cutting of the position ID. The opponent doesn't change during the session
+                if self.other is None:
+                    self.other = str(actor).rsplit("_", 1)[0]
+                    self.load_opponent_data()
+                    self.load_opponent_model()
 
                 # process action done by opponent
                 self.opponent_action(action)
@@ -114,6 +163,7 @@ class BoboAgent(DefaultParty):
         # Finished will be send if the negotiation has ended (through agreement or deadline)
         elif isinstance(data, Finished):
             self.save_data()
+            self.save_opponent_model()
             # terminate the agent MUST BE CALLED
             self.logger.log(logging.INFO, "party is terminating:")
             super().terminate()
@@ -121,18 +171,56 @@ class BoboAgent(DefaultParty):
             self.logger.log(logging.WARNING, "Ignoring unknown info " + str(data))
 
     def load_opponent_data(self):
-        """Loads opponent history from data.md if available."""
+        """Loads the most recent opponent history from data.md if available."""
+        if self.storage_dir is None:
+            return
+
         data_path = os.path.join(self.storage_dir, "data.md")
         if not os.path.exists(data_path):
             return
 
         with open(data_path, "r") as f:
-            for line in f:
-                parts = line.strip().split(",")
-                if len(parts) == 3 and parts[0] == self.other:
-                    self.opponent_is_greedy = parts[1] == "True"
-                    self.opponent_is_nice = parts[2] == "True"
-                    break  # Stop searching once found
+            lines = f.readlines()
+
+        # records are appended after every session, so the freshest one for this opponent is the last one
+        for line in reversed(lines):
+            parts = line.rstrip("\n").split(",", 2)
+            if len(parts) == 3 and parts[0] == self.other:
+                self.opponent_is_greedy = parts[1] == "True"
+                self.opponent_is_nice = parts[2] == "True"
+                break  # Stop searching once found
+
+    def opponent_model_path(self) -> str:
+        """Path of the stored opponent model of the current opponent on the current domain, while we hold our
+        current profile. In a tournament the opponent plays the domain with either profile, and what it offers
+        depends on which one it holds. The model version is part of the name, so snapshots of other versions
+        are never unpickled.
+        """
+        session_key = hashlib.sha1((str(self.domain) + str(self.profile)).encode()).hexdigest()
+        return os.path.join(self.storage_dir, f"om_v{OpponentModel.VERSION}_{session_key}_{self.other}.pkl")
+
+    def load_opponent_model(self):
+        """Warm starts the opponent model from earlier sessions against this opponent on this domain and profile, if available."""
+        if self.storage_dir is None:
+            return
+
+        model_path = self.opponent_model_path()
+        if not os.path.exists(model_path):
+            return
+
+        # a broken snapshot must never cost us the session, whatever goes wrong while unpickling it
+        try:
+            with open(model_path, "rb") as f:
+                opponent_model = pickle.load(f)
+        except Exception:
+            self.logger.log(logging.WARNING, "Ignoring unreadable opponent model " + model_path)
+            return
+
+        if isinstance(opponent_model, OpponentModel):
+            opponent_model.domain = self.domain  # not stored in the snapshot
+            opponent_model.forget(CARRIED_OVER_BIDS)
+            self.opponent_model = opponent_model
+
     def getCapabilities(self) -> Capabilities:
         """MUST BE IMPLEMENTED
         Method to indicate to the protocol what the capabilities of this agent are.
@@ -181,12 +269,14 @@ class BoboAgent(DefaultParty):
 
             # track opponent utility for their own offer
             util = self.opponent_model.get_predicted_utility(bid)
+            if len(self.opponent_utils) == self.opponent_utils.maxlen:
+                self.opponent_utils_sum -= self.opponent_utils[0]
             self.opponent_utils.append(util)
+            self.opponent_utils_sum += util
 
             # Check if they are greedy (after at least 3 offers)
             if len(self.opponent_utils) >= 3:
-                recent = self.opponent_utils[-5:]
-                avg_util = sum(recent) / len(recent)
+                avg_util = self.opponent_utils_sum / len(self.opponent_utils)
                 if avg_util > 0.87:  # average utils so we consider a robot bully and change our appraoch
                     self.opponent_is_greedy = True
                     self.opponent_is_nice = False
@@ -198,13 +288,16 @@ class BoboAgent(DefaultParty):
         """This method is called when it is our turn. It should decide upon an action
         to perform and send this action to the opponent.
         """
+        # progress of the negotiation session between 0 and 1 (1 is deadline), read once for the whole turn
+        progress = self.progress.get(time() * 1000)
+
         # check if the last received offer is good enough
-        if self.accept_condition(self.last_received_bid):
+        if self.accept_condition(self.last_received_bid, progress):
             # if so, accept the offer
             action = Accept(self.me, self.last_received_bid)
         else:
             # if not, find a bid to propose as counter offer
-            bid = self.find_bid()
+            bid = self.find_bid(progress)
             action = Offer(self.me, bid)
 
         # send the action
@@ -212,15 +305,33 @@ class BoboAgent(DefaultParty):
 
     def save_data(self):
         """Stores opponent behavior data in data.md."""
-        if self.other is None:
-            return  # No opponent data to save
+        if self.other is None or self.storage_dir is None:
+            return  # No opponent data to save, or nowhere to save it
 
         data_path = os.path.join(self.storage_dir, "data.md")
         opponent_data = f"{self.other},{self.opponent_is_greedy},{self.opponent_is_nice}\n"
 
-        # Append data without overwriting
-        with open(data_path, "a") as f:
-            f.write(opponent_data)
+        # Append data without overwriting, as a single unbuffered write so records of sessions running in parallel don't interleave
+        with open(data_path, "ab", buffering=0) as f:
+            f.write(opponent_data.encode())
+
+    def save_opponent_model(self):
+        """Stores the opponent model so later sessions against this opponent on this domain and profile can start from it."""
+        if self.opponent_model is None or self.other is None or self.storage_dir is None:
+            return
+
+        # write to a temporary file first, so sessions running in parallel never read a half written model.
+        # A failed snapshot is not worth failing to terminate over, so it is only logged
+        temp_path = None
+        try:
+            with tempfile.NamedTemporaryFile("wb", dir=self.storage_dir, delete=False) as f:
+                temp_path = f.name
+                pickle.dump(self.opponent_model, f)
+            os.replace(temp_path, self.opponent_model_path())
+        except Exception:
+            self.logger.log(logging.WARNING, "Could not store opponent model in " + self.storage_dir)
+            if temp_path is not None and os.path.exists(temp_path):
+                os.remove(temp_path)
 
     ###########################################################################################
     ################################## Example methods below ##################################
@@ -242,40 +353,32 @@ class BoboAgent(DefaultParty):
     #     ]
     #     return all(conditions)
 
-    def accept_condition(self, bid: Bid) -> bool:
+    def accept_condition(self, bid: Bid, progress: float) -> bool:
         # if there's no bid, nothing to accept
         if bid is None:
             return False
 
-        # calculate progress and the utility we are expecting
-        progress = self.progress.get(time() * 1000)
-        offered_util = self.profile.getUtility(bid)
+        # calculate the utility we are expecting
+        offered_util = self.our_utility(bid)
 
         # if the offer is really good, we can accept straight away, no need to gamble for more
         if offered_util >= 0.9:
             return True
 
-        if self.opponent_is_greedy and offered_util > 0.75:
+        greedy, nice = self.opponent_is_greedy, self.opponent_is_nice
+
+        if greedy and offered_util > 0.75:
             return True  # Take the decent deal while you can
 
         if self.opponent_model:
-            opponent_util = float(self.opponent_model.get_predicted_utility(bid))
+            opponent_util = self.opponent_model.get_predicted_utility(bid)
 
-            # If both sides get 0.75+, accept — it’s fair
-            if self.opponent_is_nice and progress > 0.75:
-                if offered_util > 0.75 and opponent_util > 0.7:
+            for progress_from, progress_to, util_above, opponent_from, opponent_to in NICE_ACCEPT_RULES if nice else ACCEPT_RULES:
+                if progress_from < progress < progress_to and offered_util > util_above and opponent_from < opponent_util < opponent_to:
                     return True
 
-            # If opponent is conceding early and we got something decent
-            if progress < 0.6 and offered_util > 0.75 and opponent_util < 0.7:
-                return True
-
-            # Accept near end if both sides are being fair
-            if progress > 0.97 and float(offered_util) > 0.85 and float(opponent_util) > 0.6:
-                return True
-
             # If both agents do well together, accept Nash-like reasoning
-            if not self.opponent_is_greedy and float(offered_util) * float(opponent_util) > 0.75:
+            if not greedy and offered_util * opponent_util > 0.75:
                 return True
 
             # Reject greedy offers late in the game
@@ -290,118 +393,216 @@ class BoboAgent(DefaultParty):
             return offered_util > threshold
         return False
 
-    # this method finds a good bid to send the oponent, using heuristics and sampling
-    def find_bid(self) -> Bid:
-        # this gets the current negotiation domain
-        domain = self.profile.getDomain()
-        # all possible bids in the domain (its finite)
-        all_bids = AllBidsList(domain)
+    def our_utility(self, bid: Bid) -> float:
+        """Our utility of a bid, looked up in the profile only the first time the bid is seen.
+
+        Args:
+            bid (Bid): bid to get the utility of
 
-        # initalize variables for later
-        best_bid_score = 0.0
-        best_bid = None
+        Returns:
+            float: our utility of the bid
+        """
+        if bid not in self._our_util_cache:
+            self._our_util_cache[bid] = float(self.profile.getUtility(bid))
+        return self._our_util_cache[bid]
+
+    def utility_table_path(self) -> str:
+        """Path of the stored utility table of our current profile."""
+        profile_key = hashlib.sha1(str(self.profile).encode()).hexdigest()
+        return os.path.join(self.storage_dir, f"utils_v{UTILITY_TABLE_VERSION}_{profile_key}.npz")
+
+    def bid_order(self) -> list:
+        """Issues in the order AllBidsList counts through them, the one that changes from one bid to the next first.
+        AllBidsList takes the issues from a set, so this order can differ between sessions.
+
+        Returns:
+            list: issues with more than one value, in counting order
+        """
+        first, issues, step = self._all_bids.get(0), [], 1
+        while step < self._all_bids_size:
+            # the bid at a step only differs from the first bid in the next issue to count through
+            bid = self._all_bids.get(step)
+            issue = next(issue for issue in self.domain.getIssues() if bid.getValue(issue) != first.getValue(issue))
+            issues.append(issue)
+            step *= self.domain.getValues(issue).size()
+        return issues
+
+    def load_utility_table(self, table_path: str, bid_order: list) -> np.ndarray:
+        """Loads a stored utility table and puts its rows in the order of our AllBidsList.
+
+        Args:
+            table_path (str): path of the stored table
+            bid_order (list): issues in the order our AllBidsList counts through them, see bid_order
+
+        Returns:
+            np.ndarray: our utility of every bid, None if the table doesn't fit our bids
+        """
+        with np.load(table_path) as stored:
+            our_utils, stored_order = stored["utils"], stored["issues"].tolist()
+        if our_utils.shape != (self._all_bids_size,) or sorted(stored_order) != sorted(bid_order):
+            return None
+
+        # the table was written by a session that counted through the issues in another order, look up where each of our bids is in it
+        if stored_order != bid_order:
+            sizes = {issue: self.domain.getValues(issue).size() for issue in bid_order}
+            steps, stored_steps = {}, {}
+            for order, order_steps in ((bid_order, steps), (stored_order, stored_steps)):
+                step = 1
+                for issue in order:
+                    order_steps[issue] = step
+                    step *= sizes[issue]
+
+            positions = np.arange(self._all_bids_size)
+            stored_positions = np.zeros(self._all_bids_size, dtype=np.int64)
+            for issue in bid_order:
+                stored_positions += positions // steps[issue] % sizes[issue] * stored_steps[issue]
+            our_utils = our_utils[stored_positions]
+
+        # check a few bids against our profile, so a table that still doesn't match is never used
+        for i in np.linspace(0, self._all_bids_size - 1, 8).astype(int):
+            if our_utils[i] != float(self.profile.getUtility(self._all_bids.get(int(i)))):
+                return None
+        return our_utils
+
+    def build_utility_table(self):
+        """Tabulates our utility for every bid in the domain. The bid space and our profile
+        are static during the session, so this only has to be done once. The table is kept
+        in storage_dir, so later sessions with the same profile can load it instead.
+        Domains too large to search completely only get an empty table, see sampled_utilities.
+        """
+        if self._all_bids_size > FULL_SCAN_MAX_BIDS:
+            # we only ever sample bids from these, tabulating all of them would take most of the first turn
+            self._our_utils = np.empty(self._all_bids_size)
+            self._our_utils_filled = np.zeros(self._all_bids_size, dtype=bool)
+            return
+
+        table_path = None if self.storage_dir is None else self.utility_table_path()
+        bid_order = self.bid_order()
+        if table_path is not None and os.path.exists(table_path):
+            # the table is only a cache, whatever is wrong with it we can compute it again
+            try:
+                self._our_utils = self.load_utility_table(table_path, bid_order)
+            except Exception:
+                self.logger.log(logging.WARNING, "Ignoring unreadable utility table " + table_path)
+
+        if self._our_utils is None:
+            get_bid, get_utility, size = self._all_bids.get, self.profile.getUtility, self._all_bids_size
+            self._our_utils = np.fromiter((float(get_utility(get_bid(i))) for i in range(size)), dtype=float, count=size)
+
+            if table_path is not None:
+                # write to a temporary file first, so sessions running in parallel never read a half written table.
+                # The table is only a cache, so a failed write is only logged
+                temp_path = None
+                try:
+                    with tempfile.NamedTemporaryFile("wb", dir=self.storage_dir, delete=False) as f:
+                        temp_path = f.name
+                        np.savez(f, utils=self._our_utils, issues=np.array(bid_order, dtype=str))
+                    os.replace(temp_path, table_path)
+                except Exception:
+                    self.logger.log(logging.WARNING, "Could not store utility table in " + self.storage_dir)
+                    if temp_path is not None and os.path.exists(temp_path):
+                        os.remove(temp_path)
+
+        self._ranked_bids = np.argsort(-self._our_utils, kind="stable")
+
+    def sampled_utilities(self, indices: np.ndarray) -> np.ndarray:
+        """Our utilities for sampled bids in a domain too large to tabulate, a bid is only
+        looked up in the profile the first time it gets sampled.
+
+        Args:
+            indices (np.ndarray): indices of the bids in the domain
+
+        Returns:
+            np.ndarray: our utility of each bid
+        """
+        missing = np.unique(indices[~self._our_utils_filled[indices]])
+        if missing.size > 0:
+            get_bid, get_utility = self._all_bids.get, self.profile.getUtility
+            self._our_utils[missing] = [float(get_utility(get_bid(int(i)))) for i in missing]
+            self._our_utils_filled[missing] = True
+
+        return self._our_utils[indices]
+
+    def opponent_utilities(self, indices: np.ndarray) -> np.ndarray:
+        """Predicted opponent utilities for bids in the domain, all computed in one go by the opponent model.
+        The issue values of a bid are only looked up the first time it gets scored.
+
+        Args:
+            indices (np.ndarray): indices of the bids in the domain
+
+        Returns:
+            np.ndarray: predicted opponent utility of each bid
+        """
+        if self._bid_values is None:
+            self._bid_values = np.empty((self._all_bids_size, len(self.opponent_model.issues)), dtype=np.int64)
+            self._bid_values_filled = np.zeros(self._all_bids_size, dtype=bool)
+
+        # look up the issue values of bids that were never scored before
+        missing = np.unique(indices[~self._bid_values_filled[indices]])
+        if missing.size > 0:
+            get_bid, bid_values = self._all_bids.get, self.opponent_model.bid_values
+            self._bid_values[missing] = [bid_values(get_bid(int(i))) for i in missing]
+            self._bid_values_filled[missing] = True
+
+        return self.opponent_model.get_predicted_utility_batch(self._bid_values[indices])
+
+    # this method finds a good bid to send the oponent, using heuristics and sampling
+    def find_bid(self, progress: float) -> Bid:
+        if self._our_utils is None:
+            self.build_utility_table()
 
-        # progress so far in the bid wars
-        progress = self.progress.get(time() * 1000)
         # we define the minimum utility we would want a bid to have to be considered, it decreases at time passes since we are getting close to the
         min_util = 0.85 * (1 - 0.25 * progress)  # more assertive min util
 
-        # we are random sampling 500 binds
-        for _ in range(1000):
-            bid = all_bids.get(randint(0, all_bids.size() - 1))
+        # ensure we don't concede too much unless we have to, if its too low we skip it based on the minimum utility we calculated for this round
+        if self._all_bids_size <= FULL_SCAN_MAX_BIDS:
+            # small enough domain to consider every bid above the minimum utility, these are the best ranked ones for us
+            indices = self._ranked_bids[: np.count_nonzero(self._our_utils >= min_util)]
+        else:
+            # we are random sampling 1000 bids
+            indices = self._rng.integers(0, self._all_bids_size, size=1000)
+            indices = indices[self.sampled_utilities(indices) >= min_util]
 
-            # ensure we don't concede too much unless we have to, if its too low we skip it based on the minimum utility we calculated for this round
-            if self.profile.getUtility(bid) < min_util:
-                continue
+        # we first score the bids with the highest possible score, the others only need the opponent model if they can still beat the best of those
+        bounds = upper_bound(self._our_utils[indices], progress, 0.1, self.opponent_is_greedy, self.opponent_is_nice)
+        order = np.argsort(-bounds, kind="stable")
+        head, tail = order[:32], order[32:]
+        head_scores = self.score_bids(indices[head], progress)
+        if head_scores.size > 0:
+            tail = tail[bounds[tail] >= head_scores.max()]
 
-            # we score the bid based on the score bid method which combines our utilities together and time pressure into a score
-            bid_score = self.score_bid(bid)
+            # nothing left that could beat the best of those, we are done
+            if tail.size == 0 and head_scores.max() > 0.0:
+                return self._all_bids.get(int(indices[head[np.argmax(head_scores)]]))
 
-            # if this is the best bid we have seen so far, we store it
-            if bid_score > best_bid_score:
-                best_bid_score, best_bid = bid_score, bid
+        candidates = np.concatenate([head, tail])
+        scores = np.concatenate([head_scores, self.score_bids(indices[tail], progress)])
 
         # if no bid has been chosen, we pick a random one to avoid sending nothing
-        if best_bid is None:
-            best_bid = all_bids.get(randint(0, all_bids.size() - 1))  # safety
+        if scores.size == 0 or scores.max() <= 0.0:
+            return self._all_bids.get(int(self._rng.integers(0, self._all_bids_size)))  # safety
 
-        return best_bid
+        return self._all_bids.get(int(indices[candidates[np.argmax(scores)]]))
 
-    def score_bid(self, bid: Bid, alpha: float = 0.75, eps: float = 0.1) -> float:
-        """Calculate heuristic score for a bid
+    def score_bids(self, indices: np.ndarray, progress: float, alpha: float = 0.75, eps: float = 0.1) -> np.ndarray:
+        """Calculate heuristic scores for a batch of bids
 
         Args:
-            bid (Bid): Bid to score
+            indices (np.ndarray): indices of the bids to score in the domain
+            progress (float): progress of the negotiation session between 0 and 1
             alpha (float, optional): Trade-off factor between self interested and
                 altruistic behaviour. Defaults to 0.95.
             eps (float, optional): Time pressure factor, balances between conceding
                 and Boulware behaviour over time. Defaults to 0.1.
 
         Returns:
-            float: score
+            np.ndarray: score of each bid
         """
+        our_utility = self._our_utils[indices]
 
         if self.opponent_model is None:
             # fallback: only consider our own utility
-            print("NO MODEL")
-            our_utility = float(self.profile.getUtility(bid))
-            progress = self.progress.get(time() * 1000)
-            time_pressure = 1.0 - progress ** (1 / eps)
-            return alpha * time_pressure * our_utility
-
-        progress = self.progress.get(time() * 1000)
-
-        if self.opponent_model is not None:
-            opponent_utility = self.opponent_model.get_predicted_utility(bid)
+            return alpha * time_pressure(progress, eps) * our_utility
 
-        # we penalize bids with very low predicted utility for the oponent, especially early in the session because oponent would be sure to reject (if its not a greedy robot)
-        if not self.opponent_is_greedy:
-            rejection_threshold = 0.1 - 0.08 * progress
-            if opponent_utility < rejection_threshold:
-                print("rej thresh")
-                return 0.0
-        else:
-            opponent_utility = 0.5  # fallback
-
-        # # Dynamically adjust alpha over time
-        # if progress < 0.2:
-        #     alpha = 0.95  # starting off strong
-        # elif progress < 0.8:
-        #     alpha = 0.75  # common ground between having a high utility score and cooperating with the oponent
-        # else:
-        #     alpha = 0.5   # fully cooperating with the oponent to find a common point to make a deal
-
-        if self.opponent_is_nice and progress <0.66:
-            alpha = 0.7  # favor fairness more
-        elif self.opponent_is_greedy:
-            alpha = 0.95  # favor ourselves
-        else:
-            alpha = 0.95 - 0.45 * progress
-
-
-        # calculate our otility at the moment based on this bid
-        our_utility = float(self.profile.getUtility(bid))
-        print(our_utility)
-        if not self.opponent_is_greedy: #penalize greedyness late, unless the opponent is also greedy
-            if our_utility > 0.9 and progress > 0.6:
-                our_utility = our_utility -0.1
-            if our_utility > 0.8 and progress > 0.8:#they are meant to stack
-                our_utility = our_utility -0.2
-            if our_utility > 0.8 and progress > 0.9:
-                our_utility = our_utility -0.3
-
-        # calculate if there's any time pressure or not
-        time_pressure = 1.0 - progress ** (1 / eps)
-        # the score will now be based on how far we are into the game, how much the agent cares about time in its decision making and our utility in this bid
-        score = alpha * time_pressure * our_utility
-
-        if self.opponent_model is not None:
-            # get oponent's predicted utility
-            opponent_utility = self.opponent_model.get_predicted_utility(bid)
-            # calculate the oponents score to complement our score to get to a total of 1 potentially
-            opponent_score = (1.0 - alpha * time_pressure) * opponent_utility
-            score += opponent_score
-
-        # return the expected score between both robots based on the moment of the game
-        print("normal game")
-        return score
\ No newline at end of file
+        opponent_utility = self.opponent_utilities(indices)
+        return score(our_utility, opponent_utility, progress, eps, self.opponent_is_greedy, self.opponent_is_nice)
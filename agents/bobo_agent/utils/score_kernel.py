@@ -0,0 +1,72 @@
+import numpy as np
+
+
+def trade_off(progress: float, greedy: bool, nice: bool) -> float:
+    """Trade-off factor between self interested and altruistic behaviour, based on the opponent type."""
+    if nice and progress < 0.66:
+        return 0.7  # favor fairness more
+    if greedy:
+        return 0.95  # favor ourselves
+    return 0.95 - 0.45 * progress
+
+
+def time_pressure(progress: float, eps: float) -> float:
+    """Time pressure at the given progress, from 1 at the start of the session to 0 at the deadline."""
+    if eps == 0.1:
+        # progress ** 10 by repeated squaring, avoids the pow call for the default eps
+        p2 = progress * progress
+        p4 = p2 * p2
+        return 1.0 - p4 * p4 * p2
+    return 1.0 - progress ** (1 / eps)
+
+
+def score(
+    our_utility: np.ndarray,
+    opponent_utility: np.ndarray,
+    progress: float,
+    eps: float,
+    greedy: bool,
+    nice: bool,
+) -> np.ndarray:
+    """Heuristic scores of bids, given our utility and the predicted opponent utility for each of them.
+
+    Args:
+        our_utility (np.ndarray): our utility of the bids
+        opponent_utility (np.ndarray): predicted opponent utility of the bids
+        progress (float): progress of the negotiation session between 0 and 1
+        eps (float): time pressure factor, balances between conceding and Boulware behaviour
+        greedy (bool): whether the opponent is considered greedy
+        nice (bool): whether the opponent is considered nice
+
+    Returns:
+        np.ndarray: score of each bid
+    """
+    alpha = trade_off(progress, greedy, nice)
+
+    if not greedy:  # penalize greedyness late, unless the opponent is also greedy
+        if progress > 0.6:
+            our_utility = np.where(our_utility > 0.9, our_utility - 0.1, our_utility)
+        if progress > 0.8:  # they are meant to stack
+            our_utility = np.where(our_utility > 0.8, our_utility - 0.2, our_utility)
+        if progress > 0.9:
+            our_utility = np.where(our_utility > 0.8, our_utility - 0.3, our_utility)
+
+    # the score is based on how far we are into the game, how much the agent cares about time in its decision making and our utility in this bid,
+    # complemented by the oponents utility to get to a total of 1 potentially
+    alpha_tp = alpha * time_pressure(progress, eps)
+    scores = alpha_tp * our_utility + (1.0 - alpha_tp) * opponent_utility
+
+    # we penalize bids with very low predicted utility for the oponent, especially early in the session because oponent would be sure to reject (if its not a greedy robot)
+    if not greedy:
+        scores = np.where(opponent_utility < 0.1 - 0.08 * progress, 0.0, scores)
+
+    return scores
+
+
+def upper_bound(our_utility, progress: float, eps: float, greedy: bool, nice: bool):
+    """Upper bound on the score of bids with the given utility for us, whatever the opponent utility is.
+    The penalties only lower our utility and the predicted opponent utility is at most 1.
+    Works on floats and NumPy arrays alike.
+    """
+    alpha_tp = trade_off(progress, greedy, nice) * time_pressure(progress, eps)
+    return alpha_tp * our_utility + (1.0 - alpha_tp)
@@ -1,8 +1,15 @@
+import hashlib
 import logging
-from random import randint
+import os
+import pickle
+import tempfile
+from bisect import bisect_left
+from collections import deque
 from time import time
 from typing import cast
 
+import numpy as np
+
 from geniusweb.actions.Accept import Accept
 from geniusweb.actions.Action import Action
 from geniusweb.actions.Offer import Offer
@@ -28,6 +35,20 @@ from geniusweb.references.Parameters import Parameters
 from tudelft_utilities_logging.ReportToLogger import ReportToLogger
 
 from .utils.opponent_model import OpponentModel
+from .utils.score_kernel import score, upper_bound
+
+# Bump when the utility table computation changes, stored tables of other versions are ignored
+UTILITY_TABLE_VERSION = 2
+
+# Domains up to this many bids are searched completely, larger ones are sampled
+FULL_SCAN_MAX_BIDS = 50000
+
+# Received bids an opponent model carried over from earlier sessions counts as at most
+CARRIED_OVER_BIDS = 50
+
+# Utility an offer must exceed to be accepted once progress is past each of these points
+ACCEPT_PROGRESS = (0.95, 0.98)
+ACCEPT_UTILITY = (0.85, 0.8, 0.75)
 
 
 class BoboAgentDynamic(DefaultParty):
@@ -48,7 +69,20 @@ class BoboAgentDynamic(DefaultParty):
 
         self.last_received_bid: Bid = None
         self.opponent_model: OpponentModel = None
-        self.opponent_utils = []
+        self.opponent_utils = deque(maxlen=5)  # Predicted utilities of the 5 most recent opponent offers
+        self.opponent_utils_sum = 0.0
+
+        self._all_bids: AllBidsList = None
+        self._all_bids_size: int = 0
+
+        # Our utility and the issue values, numbered like the opponent model does, of every bid, indexed like AllBidsList
+        self._our_utils: np.ndarray = None
+        self._our_utils_filled: np.ndarray = None  # Rows of _our_utils looked up so far, only in sampled domains
+        self._bid_values: np.ndarray = None
+        self._bid_values_filled: np.ndarray = None  # Rows of _bid_values looked up so far
+        self._ranked_bids: np.ndarray = None  # Indices of all bids, best for us first, only in fully searched domains
+        self._rng = np.random.default_rng()  # Samples bids
+        self._our_util_cache = {}  # Our utility of offered bids, the profile is static
 
         # Weights replacing boolean flags
         self.greedy_weight = 0.0  # Opponent greediness: 0 (not greedy) to 1 (very greedy)
@@ -70,13 +104,17 @@ class BoboAgentDynamic(DefaultParty):
             )
             self.profile = profile_connection.getProfile()
             self.domain = self.profile.getDomain()
+            self._all_bids = AllBidsList(self.domain)
+            self._all_bids_size = self._all_bids.size()
             profile_connection.close()
 
         elif isinstance(data, ActionDone):
             action = cast(ActionDone, data).getAction()
             actor = action.getActor()
             if actor != self.me:
-                self.other = str(actor).rsplit("_", 1)[0]
+                if self.other is None:
+                    self.other = str(actor).rsplit("_", 1)[0]
+                    self.load_opponent_model()
                 self.opponent_action(action)
 
         elif isinstance(data, YourTurn):
@@ -84,12 +122,40 @@ class BoboAgentDynamic(DefaultParty):
 
         elif isinstance(data, Finished):
             self.save_data()
+            self.save_opponent_model()
             self.logger.log(logging.INFO, "Negotiation ended")
             super().terminate()
 
         else:
             self.logger.log(logging.WARNING, "Ignoring unknown info " + str(data))
 
+    def opponent_model_path(self) -> str:
+        """Returns the path of the stored model of this opponent on this domain, while we hold this profile."""
+        # The opponent offers differently depending on the profile it holds, which our profile fixes
+        session_key = hashlib.sha1((str(self.domain) + str(self.profile)).encode()).hexdigest()
+        return os.path.join(self.storage_dir, f"om_v{OpponentModel.VERSION}_{session_key}_{self.other}.pkl")
+
+    def load_opponent_model(self):
+        """Warm starts the opponent model from earlier sessions, if there are any."""
+        if self.storage_dir is None:
+            return
+
+        model_path = self.opponent_model_path()
+        if not os.path.exists(model_path):
+            return
+
+        try:  # A broken snapshot must never cost us the session
+            with open(model_path, "rb") as f:
+                opponent_model = pickle.load(f)
+        except Exception:
+            self.logger.log(logging.WARNING, "Ignoring unreadable opponent model " + model_path)
+            return
+
+        if isinstance(opponent_model, OpponentModel):
+            opponent_model.domain = self.domain  # Not stored in the snapshot
+            opponent_model.forget(CARRIED_OVER_BIDS)  # So the offers of this session soon outweigh it
+            self.opponent_model = opponent_model
+
     def getCapabilities(self) -> Capabilities:
         """Returns agent capabilities."""
         return Capabilities(
@@ -116,11 +182,13 @@ class BoboAgentDynamic(DefaultParty):
             self.last_received_bid = bid
 
             util = self.opponent_model.get_predicted_utility(bid)
+            if len(self.opponent_utils) == self.opponent_utils.maxlen:
+                self.opponent_utils_sum -= self.opponent_utils[0]
             self.opponent_utils.append(util)
+            self.opponent_utils_sum += util
 
             if len(self.opponent_utils) >= 3:
-                recent = self.opponent_utils[-5:]
-                avg_util = sum(recent) / len(recent)
+                avg_util = self.opponent_utils_sum / len(self.opponent_utils)
                 progress = self.progress.get(time() * 1000)
 
                 # Greedy weight (slower increase)
@@ -131,27 +199,47 @@ class BoboAgentDynamic(DefaultParty):
 
     def my_turn(self):
         """Executes the next action."""
-        if self.accept_condition(self.last_received_bid):
+        progress = self.progress.get(time() * 1000)
+        if self.accept_condition(self.last_received_bid, progress):
             action = Accept(self.me, self.last_received_bid)
         else:
-            bid = self.find_bid()
+            bid = self.find_bid(progress)
             action = Offer(self.me, bid)
 
         self.send_action(action)
 
     def save_data(self):
         """Stores learning data."""
-        data = "Learning data (see README.md)"
-        with open(f"{self.storage_dir}/data.md", "w") as f:
-            f.write(data)
+        if self.storage_dir is None:
+            return
 
-    def accept_condition(self, bid: Bid) -> bool:
+        data = "Learning data (see README.md)"
+        with open(f"{self.storage_dir}/data.md", "wb", buffering=0) as f:
+            f.write(data.encode())
+
+    def save_opponent_model(self):
+        """Stores the opponent model for later sessions against this opponent."""
+        if self.opponent_model is None or self.other is None or self.storage_dir is None:
+            return
+
+        # Temporary file first, so parallel sessions never load a partial model; failures are only logged
+        temp_path = None
+        try:
+            with tempfile.NamedTemporaryFile("wb", dir=self.storage_dir, delete=False) as f:
+                temp_path = f.name
+                pickle.dump(self.opponent_model, f)
+            os.replace(temp_path, self.opponent_model_path())
+        except Exception:
+            self.logger.log(logging.WARNING, "Could not store opponent model in " + self.storage_dir)
+            if temp_path is not None and os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def accept_condition(self, bid: Bid, progress: float) -> bool:
         """Determines whether to accept an offer."""
         if bid is None:
             return False
 
-        progress = self.progress.get(time() * 1000)
-        offered_util = self.profile.getUtility(bid)
+        offered_util = self.our_utility(bid)
 
         if offered_util >= 0.85:
             return True
@@ -160,7 +248,7 @@ class BoboAgentDynamic(DefaultParty):
             return True
 
         if self.opponent_model:
-            opponent_util = float(self.opponent_model.get_predicted_utility(bid))
+            opponent_util = self.opponent_model.get_predicted_utility(bid)
 
             if progress > 0.95 and offered_util > 0.75 and opponent_util > 0.6:
                 return True
@@ -168,34 +256,151 @@ class BoboAgentDynamic(DefaultParty):
             if progress > 0.99 and offered_util > 0.7 and opponent_util < 0.5:
                 return True
 
-        return offered_util > (0.75 if progress > 0.98 else 0.8 if progress > 0.95 else 0.85)
-
-    def find_bid(self) -> Bid:
+        return offered_util > ACCEPT_UTILITY[bisect_left(ACCEPT_PROGRESS, progress)]
+
+    def our_utility(self, bid: Bid) -> float:
+        """Returns our utility of a bid, cached per bid."""
+        if bid not in self._our_util_cache:
+            self._our_util_cache[bid] = float(self.profile.getUtility(bid))
+        return self._our_util_cache[bid]
+
+    def utility_table_path(self) -> str:
+        """Returns the path of the stored utility table of our profile."""
+        profile_key = hashlib.sha1(str(self.profile).encode()).hexdigest()
+        return os.path.join(self.storage_dir, f"utils_v{UTILITY_TABLE_VERSION}_{profile_key}.npz")
+
+    def bid_order(self) -> list:
+        """Returns the issues in the order AllBidsList counts through them, fastest changing first.
+        AllBidsList takes the issues from a set, so the order can differ between sessions."""
+        first, issues, step = self._all_bids.get(0), [], 1
+        while step < self._all_bids_size:
+            # The bid at a step only differs from the first bid in the next issue counted through
+            bid = self._all_bids.get(step)
+            issue = next(issue for issue in self.domain.getIssues() if bid.getValue(issue) != first.getValue(issue))
+            issues.append(issue)
+            step *= self.domain.getValues(issue).size()
+        return issues
+
+    def load_utility_table(self, table_path: str, bid_order: list) -> np.ndarray:
+        """Loads a stored utility table in the order of our AllBidsList, None if it doesn't fit our bids."""
+        with np.load(table_path) as stored:
+            our_utils, stored_order = stored["utils"], stored["issues"].tolist()
+        if our_utils.shape != (self._all_bids_size,) or sorted(stored_order) != sorted(bid_order):
+            return None
+
+        # Written by a session counting through the issues in another order, find each of our bids in it
+        if stored_order != bid_order:
+            sizes = {issue: self.domain.getValues(issue).size() for issue in bid_order}
+            steps, stored_steps = {}, {}
+            for order, order_steps in ((bid_order, steps), (stored_order, stored_steps)):
+                step = 1
+                for issue in order:
+                    order_steps[issue] = step
+                    step *= sizes[issue]
+
+            positions = np.arange(self._all_bids_size)
+            stored_positions = np.zeros(self._all_bids_size, dtype=np.int64)
+            for issue in bid_order:
+                stored_positions += positions // steps[issue] % sizes[issue] * stored_steps[issue]
+            our_utils = our_utils[stored_positions]
+
+        # Spot check against our profile, a table that still doesn't match is never used
+        for i in np.linspace(0, self._all_bids_size - 1, 8).astype(int):
+            if our_utils[i] != float(self.profile.getUtility(self._all_bids.get(int(i)))):
+                return None
+        return our_utils
+
+    def build_utility_table(self):
+        """Tabulates our utility for every bid in the domain, reusing a stored table of our profile if there is one.
+        Domains too large to search completely get an empty table, filled in by sampled_utilities."""
+        if self._all_bids_size > FULL_SCAN_MAX_BIDS:
+            self._our_utils = np.empty(self._all_bids_size)
+            self._our_utils_filled = np.zeros(self._all_bids_size, dtype=bool)
+            return
+
+        table_path = None if self.storage_dir is None else self.utility_table_path()
+        bid_order = self.bid_order()
+        if table_path is not None and os.path.exists(table_path):
+            try:  # Only a cache, anything wrong with it means computing it again
+                self._our_utils = self.load_utility_table(table_path, bid_order)
+            except Exception:
+                self.logger.log(logging.WARNING, "Ignoring unreadable utility table " + table_path)
+
+        if self._our_utils is None:
+            get_bid, get_utility, size = self._all_bids.get, self.profile.getUtility, self._all_bids_size
+            self._our_utils = np.fromiter((float(get_utility(get_bid(i))) for i in range(size)), dtype=float, count=size)
+
+            if table_path is not None:
+                # Temporary file first, so parallel sessions never load a partial table; failures are only logged
+                temp_path = None
+                try:
+                    with tempfile.NamedTemporaryFile("wb", dir=self.storage_dir, delete=False) as f:
+                        temp_path = f.name
+                        np.savez(f, utils=self._our_utils, issues=np.array(bid_order, dtype=str))
+                    os.replace(temp_path, table_path)
+                except Exception:
+                    self.logger.log(logging.WARNING, "Could not store utility table in " + self.storage_dir)
+                    if temp_path is not None and os.path.exists(temp_path):
+                        os.remove(temp_path)
+
+        self._ranked_bids = np.argsort(-self._our_utils, kind="stable")
+
+    def sampled_utilities(self, indices: np.ndarray) -> np.ndarray:
+        """Our utilities for sampled bids, looked up in the profile the first time a bid is sampled."""
+        missing = np.unique(indices[~self._our_utils_filled[indices]])
+        if missing.size > 0:
+            get_bid, get_utility = self._all_bids.get, self.profile.getUtility
+            self._our_utils[missing] = [float(get_utility(get_bid(int(i)))) for i in missing]
+            self._our_utils_filled[missing] = True
+
+        return self._our_utils[indices]
+
+    def opponent_utilities(self, indices: np.ndarray) -> np.ndarray:
+        """Predicted opponent utilities for the given bid indices, computed as one batch.
+        Issue values are only looked up for bids that were never scored before."""
+        if self._bid_values is None:
+            self._bid_values = np.empty((self._all_bids_size, len(self.opponent_model.issues)), dtype=np.int64)
+            self._bid_values_filled = np.zeros(self._all_bids_size, dtype=bool)
+
+        missing = np.unique(indices[~self._bid_values_filled[indices]])
+        if missing.size > 0:
+            get_bid, bid_values = self._all_bids.get, self.opponent_model.bid_values
+            self._bid_values[missing] = [bid_values(get_bid(int(i))) for i in missing]
+            self._bid_values_filled[missing] = True
+
+        return self.opponent_model.get_predicted_utility_batch(self._bid_values[indices])
+
+    def find_bid(self, progress: float) -> Bid:
         """Finds a suitable bid."""
-        domain = self.profile.getDomain()
-        all_bids = AllBidsList(domain)
+        if self._our_utils is None:
+            self.build_utility_table()
 
-        best_bid_score = 0.0
-        best_bid = None
-        progress = self.progress.get(time() * 1000)
         min_util = 0.85 * (1 - 0.15 * progress)
 
-        for _ in range(500):
-            bid = all_bids.get(randint(0, all_bids.size() - 1))
-            if self.profile.getUtility(bid) < min_util:
-                continue
-
-            bid_score = self.score_bid(bid)
-            if bid_score > best_bid_score:
-                best_bid_score, best_bid = bid_score, bid
-
-        return best_bid or all_bids.get(randint(0, all_bids.size() - 1))
-
-    def score_bid(self, bid: Bid) -> float:
-        """Scores a bid based on opponent modeling and time pressure."""
-        progress = self.progress.get(time() * 1000)
-        our_utility = float(self.profile.getUtility(bid))
-        opponent_utility = self.opponent_model.get_predicted_utility(bid) if self.opponent_model else 0
-
-        alpha = max(0.6, 0.95 - 0.3 * progress * (1 - self.nice_weight))
-        return alpha * our_utility + (1.0 - alpha) * opponent_utility * (1 - self.greedy_weight)
+        if self._all_bids_size <= FULL_SCAN_MAX_BIDS:
+            # Exact: every bid above min_util, taken from the front of our ranking
+            indices = self._ranked_bids[: np.count_nonzero(self._our_utils >= min_util)]
+        else:
+            indices = self._rng.integers(0, self._all_bids_size, size=500)
+            indices = indices[self.sampled_utilities(indices) >= min_util]
+            indices = indices[np.argsort(-self._our_utils[indices], kind="stable")]
+        if indices.size == 0:
+            return self._all_bids.get(int(self._rng.integers(0, self._all_bids_size)))
+
+        # Best for us first, so we can stop at the first bid none of the later ones can beat
+        head, tail = indices[:32], indices[32:]
+        head_scores = self.score_bids(head, progress)
+        best = int(np.argmax(head_scores))
+        tail = tail[upper_bound(self._our_utils[tail], progress, self.greedy_weight, self.nice_weight) > head_scores[best]]
+        if tail.size == 0:
+            return self._all_bids.get(int(head[best]))
+
+        indices = np.concatenate([head, tail])
+        scores = np.concatenate([head_scores, self.score_bids(tail, progress)])
+        return self._all_bids.get(int(indices[np.argmax(scores)]))
+
+    def score_bids(self, indices: np.ndarray, progress: float) -> np.ndarray:
+        """Scores bids, given by their index in the domain, based on opponent modeling and time pressure."""
+        our_utility = self._our_utils[indices]
+        opponent_utility = self.opponent_utilities(indices) if self.opponent_model else 0
+        return score(our_utility, opponent_utility, progress, self.greedy_weight, self.nice_weight)
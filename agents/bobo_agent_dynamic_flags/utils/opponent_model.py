@@ -1,121 +1,125 @@
-from collections import defaultdict
+import numpy as np
 
 from geniusweb.issuevalue.Bid import Bid
 from geniusweb.issuevalue.DiscreteValueSet import DiscreteValueSet
 from geniusweb.issuevalue.Domain import Domain
-from geniusweb.issuevalue.Value import Value
 
 
 class OpponentModel:
+    # bump when the stored attributes change, it is part of the snapshot file name so snapshots of other versions are not loaded
+    VERSION = 4
+
     def __init__(self, domain: Domain):
-        self.offers = []
+        # only the number of bids received is needed, so the bids themselves are not kept
+        self.bids_received = 0
         self.domain = domain
 
-        self.issue_estimators = {
-            i: IssueEstimator(v) for i, v in domain.getIssuesValues().items()
+        issues_values = domain.getIssuesValues()
+        for value_set in issues_values.values():
+            if not isinstance(value_set, DiscreteValueSet):
+                raise TypeError(
+                    "This opponent model only supports issues with discrete values"
+                )
+
+        # number the issues and their values, so the statistics of all issues fit in (issue, value) arrays.
+        # Every issue gets one extra column at the end for values that are not part of the domain
+        self.issues = list(issues_values)
+        self.value_index = {
+            issue: {value_set.get(i): i for i in range(value_set.size())}
+            for issue, value_set in issues_values.items()
         }
-
-    def update(self, bid: Bid):
-        # keep track of all bids received
-        self.offers.append(bid)
-
-        # update all issue estimators with the value that is offered for that issue
-        for issue_id, issue_estimator in self.issue_estimators.items():
-            issue_estimator.update(bid.getValue(issue_id))
-
-    def get_predicted_utility(self, bid: Bid):
-        if len(self.offers) == 0 or bid is None:
-            return 0
-
-        # initiate
-        total_issue_weight = 0.0
-        value_utilities = []
-        issue_weights = []
-
-        for issue_id, issue_estimator in self.issue_estimators.items():
-            # get the value that is set for this issue in the bid
-            value: Value = bid.getValue(issue_id)
-
-            # collect both the predicted weight for the issue and
-            # predicted utility of the value within this issue
-            value_utilities.append(issue_estimator.get_value_utility(value))
-            issue_weights.append(issue_estimator.weight)
-
-            total_issue_weight += issue_estimator.weight
-
-        # normalise the issue weights such that the sum is 1.0
-        if total_issue_weight == 0.0:
-            issue_weights = [1 / len(issue_weights) for _ in issue_weights]
-        else:
-            issue_weights = [iw / total_issue_weight for iw in issue_weights]
-
-        # calculate predicted utility by multiplying all value utilities with their issue weight
-        predicted_utility = sum(
-            [iw * vu for iw, vu in zip(issue_weights, value_utilities)]
+        self.num_values = np.array([value_set.size() for value_set in issues_values.values()])
+        self._rows = np.arange(len(self.issues))
+
+        # counts are floats, so forget can scale them down
+        self.value_counts = np.zeros((len(self.issues), self.num_values.max() + 1))
+        self.value_utilities = np.zeros(self.value_counts.shape)
+        self.issue_weights = np.zeros(len(self.issues))
+        # issue weights normalised such that the sum is 1.0
+        self.normalised_weights = np.full(len(self.issues), 1 / len(self.issues))
+
+        # predicted utilities of bids, only valid until the next update
+        self._util_cache = {}
+
+    def __getstate__(self):
+        # predicted utilities are cheap to recompute and the domain is known to whoever loads the snapshot,
+        # so both are left out of stored snapshots
+        state = self.__dict__.copy()
+        state["_util_cache"] = {}
+        state["domain"] = None
+        return state
+
+    def forget(self, keep: int):
+        # scale the statistics down to those of `keep` received bids, so a model carried over from earlier sessions
+        # still follows what the opponent offers now. Scaling all counts alike leaves the issue weights as they are
+        if self.bids_received <= keep:
+            return
+
+        self.value_counts = self.value_counts * (keep / self.bids_received)
+        self.bids_received = keep
+
+    def bid_values(self, bid: Bid) -> np.ndarray:
+        # column of the value that is set for each issue in the bid, -1 (the extra column) for unknown values
+        return np.array(
+            [self.value_index[issue].get(bid.getValue(issue), -1) for issue in self.issues]
         )
 
-        return predicted_utility
-
-
-class IssueEstimator:
-    def __init__(self, value_set: DiscreteValueSet):
-        if not isinstance(value_set, DiscreteValueSet):
-            raise TypeError(
-                "This issue estimator only supports issues with discrete values"
-            )
-
-        self.bids_received = 0
-        self.max_value_count = 0
-        self.num_values = value_set.size()
-        self.value_trackers = defaultdict(ValueEstimator)
-        self.weight = 0
+    def update(self, bid: Bid):
+        self._util_cache.clear()
 
-    def update(self, value: Value):
+        # keep track of the number of bids received
         self.bids_received += 1
+        bids_received = self.bids_received
 
-        # get the value tracker of the value that is offered
-        value_tracker = self.value_trackers[value]
-
-        # register that this value was offered
-        value_tracker.update()
+        # register for every issue that its value in the bid was offered
+        self.value_counts[self._rows, self.bid_values(bid)] += 1
 
-        # update the count of the most common offered value
-        self.max_value_count = max([value_tracker.count, self.max_value_count])
-
-        # update predicted issue weight
+        # update predicted issue weights
         # the intuition here is that if the values of the receiverd offers spread out over all
         # possible values, then this issue is likely not important to the opponent (weight == 0.0).
         # If all received offers proposed the same value for this issue,
         # then the predicted issue weight == 1.0
-        equal_shares = self.bids_received / self.num_values
-        self.weight = (self.max_value_count - equal_shares) / (
-            self.bids_received - equal_shares
+        max_value_count = self.value_counts.max(axis=1)
+        equal_shares = bids_received / self.num_values
+        spread = bids_received - equal_shares
+        self.issue_weights = np.divide(
+            max_value_count - equal_shares,
+            spread,
+            out=np.zeros(len(self.issues)),
+            where=spread != 0,  # an issue with a single value tells us nothing
         )
 
-        # recalculate all value utilities
-        for value_tracker in self.value_trackers.values():
-            value_tracker.recalculate_utility(self.max_value_count, self.weight)
+        total_issue_weight = self.issue_weights.sum()
+        if total_issue_weight == 0.0:
+            self.normalised_weights = np.full(len(self.issues), 1 / len(self.issues))
+        else:
+            self.normalised_weights = self.issue_weights / total_issue_weight
 
-    def get_value_utility(self, value: Value):
-        if value in self.value_trackers:
-            return self.value_trackers[value].utility
+        # recalculate all value utilities, values that were never offered have utility 0
+        exponent = (1 - self.issue_weights)[:, np.newaxis]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            mod_value_count = (self.value_counts + 1) ** exponent - 1
+            mod_max_value_count = (max_value_count[:, np.newaxis] + 1) ** exponent - 1
+            value_utilities = np.where(exponent > 0, mod_value_count / mod_max_value_count, 1.0)
+        self.value_utilities = np.where(self.value_counts > 0, value_utilities, 0.0)
 
-        return 0
+    def get_predicted_utility(self, bid: Bid):
+        if self.bids_received == 0 or bid is None:
+            return 0
 
+        if bid in self._util_cache:
+            return self._util_cache[bid]
 
-class ValueEstimator:
-    def __init__(self):
-        self.count = 0
-        self.utility = 0
+        # calculate predicted utility by multiplying all value utilities with their issue weight
+        value_utilities = self.value_utilities[self._rows, self.bid_values(bid)]
+        predicted_utility = float(self.normalised_weights @ value_utilities)
 
-    def update(self):
-        self.count += 1
+        self._util_cache[bid] = predicted_utility
+        return predicted_utility
 
-    def recalculate_utility(self, max_value_count: int, weight: float):
-        if weight < 1:
-            mod_value_count = ((self.count + 1) ** (1 - weight)) - 1
-            mod_max_value_count = ((max_value_count + 1) ** (1 - weight)) - 1
+    def get_predicted_utility_batch(self, bid_values: np.ndarray) -> np.ndarray:
+        # predicted utilities of many bids at once, given as rows of value columns (see bid_values)
+        if self.bids_received == 0:
+            return np.zeros(len(bid_values))
 
-            self.utility = mod_value_count / mod_max_value_count
-        else:
-            self.utility = 1
+        return self.value_utilities[self._rows, bid_values] @ self.normalised_weights
@@ -0,0 +1,15 @@
+def trade_off(progress: float, nice_weight: float) -> float:
+    """Weight of our own utility in the score, lowered over time against nice opponents."""
+    return max(0.6, 0.95 - 0.3 * progress * (1 - nice_weight))
+
+
+def score(our_utility, opponent_utility, progress: float, greedy_weight: float, nice_weight: float):
+    """Scores bids from our and the opponent's utility. Works on floats and NumPy arrays alike."""
+    alpha = trade_off(progress, nice_weight)
+    return alpha * our_utility + (1.0 - alpha) * opponent_utility * (1 - greedy_weight)
+
+
+def upper_bound(our_utility, progress: float, greedy_weight: float, nice_weight: float):
+    """Highest score bids with our given utility can get, the opponent utility being at most 1."""
+    alpha = trade_off(progress, nice_weight)
+    return alpha * our_utility + (1.0 - alpha) * (1 - greedy_weight)